@@ -8,22 +8,19 @@ Modules:
 - flask_restful: Extension for Flask to easily build REST APIs.
 - app.database.session: Provides database session functionalities.
 - app.utils.query_helpers: Houses helper functions for querying the database.
+- app.utils.query_backends: Provides the configured analytics query backend.
+- app.utils.flow_tiles: Serves the precomputed origin-destination flow tiles.
 """
 
 # -------------------------
 # Imports
 # -------------------------
-from flask import jsonify
+from flask import jsonify, request
 from flask_restful import Resource
 from app.database.session import SessionLocal as Session
-from app.utils.query_helpers import (
-    weekly_average_for_bounding_box,
-    weekly_average_by_region,
-    regions_for_datasource,
-    most_recent_datasource_for_top_regions,
-    total_records_in_database,
-    select_all_records
-)
+from app.utils.query_helpers import select_all_records
+from app.utils.query_backends import get_query_backend
+from app.utils.flow_tiles import MAX_TILE_FLOWS, flow_tile
 
 # -------------------------
 # Resource Definitions
@@ -33,8 +30,8 @@ class WeeklyAverage(Resource):
     Resource for fetching the weekly average of trips within a bounding box.
     """
     def get(self, x1, y1, x2, y2):
-        with Session() as session:
-            result = weekly_average_for_bounding_box(session, x1, y1, x2, y2)
+        with get_query_backend() as backend:
+            result = backend.weekly_average_for_bounding_box(x1, y1, x2, y2)
         return jsonify(result)
 
 
@@ -43,8 +40,8 @@ class WeeklyAverageByRegion(Resource):
     Resource for fetching the weekly average of trips by region.
     """
     def get(self, region):
-        with Session() as session:
-            result = weekly_average_by_region(session, region)
+        with get_query_backend() as backend:
+            result = backend.weekly_average_by_region(region)
         return jsonify(result)
 
 
@@ -53,8 +50,8 @@ class DataSourceRegions(Resource):
     Resource for retrieving the regions associated with a specific data source.
     """
     def get(self, datasource):
-        with Session() as session:
-            regions = regions_for_datasource(session, datasource)
+        with get_query_backend() as backend:
+            regions = backend.regions_for_datasource(datasource)
         return jsonify(regions)
 
 
@@ -63,8 +60,8 @@ class MostRecentDataSourceForTopRegions(Resource):
     Resource to fetch the most recent data source for the top regions.
     """
     def get(self):
-        with Session() as session:
-            source = most_recent_datasource_for_top_regions(session)
+        with get_query_backend() as backend:
+            source = backend.most_recent_datasource_for_top_regions()
         return jsonify(source)
 
 
@@ -73,8 +70,8 @@ class TotalRecords(Resource):
     Resource for fetching the total number of records in the database.
     """
     def get(self):
-        with Session() as session:
-            total_records = total_records_in_database(session)
+        with get_query_backend() as backend:
+            total_records = backend.total_records_in_database()
         return jsonify({"total_records": total_records})
 
 
@@ -86,3 +83,23 @@ class SelectAllRecords(Resource):
         with Session() as session:
             all_records = select_all_records(session)
         return jsonify([record.serialize() for record in all_records])
+
+
+class FlowTile(Resource):
+    """
+    Resource for fetching the origin-destination flows within a bounding box.
+    """
+    def get(self, zoom, x1, y1, x2, y2):
+        start_hour = request.args.get("start_hour", 0, type=int)
+        end_hour = request.args.get("end_hour", 23, type=int)
+        limit = request.args.get("limit", MAX_TILE_FLOWS, type=int)
+
+        try:
+            tile = flow_tile(zoom, x1, y1, x2, y2, start_hour, end_hour, limit)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+
+        if tile is None:
+            return {"error": "Flow tiles are not available yet."}, 503
+
+        return jsonify({"zoom": zoom, **tile})
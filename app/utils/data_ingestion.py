@@ -8,6 +8,7 @@ Modules:
 - datetime: Provides functionalities to work with dates and times.
 - app.database.models: Contains ORM models for the database.
 - app.database.session: Provides database session functionalities.
+- app.utils.flow_tiles: Maintains the origin-destination flow tiles.
 - sqlalchemy: Provides ORM and query functionalities.
 """
 
@@ -18,6 +19,7 @@ import csv
 from datetime import datetime
 from app.database.models import Trip, IngestionLog
 from app.database.session import SessionLocal as Session
+from app.utils.flow_tiles import begin_flow_tiles_update, update_flow_tiles, invalidate_flow_tiles
 from sqlalchemy import func, extract
 
 # -------------------------
@@ -58,6 +60,8 @@ def ingest_csv_data(filename):
         next(reader)  # Skip the header
 
         session = Session()
+        new_flows = []
+        ingested = False
         try:
             record_count = 0
             for line in reader:
@@ -76,13 +80,18 @@ def ingest_csv_data(filename):
                     existing_trip.datasource = trip.datasource  # as an example
                 else:
                     session.add(trip)
+                    new_flows.append((trip.origin_coord, trip.destination_coord, trip.datetime))
                     record_count += 1
 
             # Add ingestion information to the IngestionLog
             ingestion_log = IngestionLog(records_added=record_count, status="success")
             session.add(ingestion_log)
 
+            # Mark the flow tiles pending, so they are rebuilt if they are not updated below
+            flow_tiles_token = begin_flow_tiles_update()
+
             session.commit()
+            ingested = True
         except Exception as e:
             # In case of an error, add a failure record and print the error
             ingestion_log = IngestionLog(records_added=record_count, status=f"failed - {str(e)}")
@@ -93,6 +102,18 @@ def ingest_csv_data(filename):
         finally:
             session.close()
 
+    # Add the new trips to the origin-destination flow tiles
+    if ingested:
+        session = Session()
+        try:
+            update_flow_tiles(session, new_flows, flow_tiles_token)
+        except Exception as e:
+            # The trips are already stored, so mark the tiles stale to rebuild them on the next update
+            invalidate_flow_tiles()
+            print(f"Error occurred while updating the flow tiles: {e}")
+        finally:
+            session.close()
+
 
 
 def group_trips_by_hour():
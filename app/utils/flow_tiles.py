@@ -0,0 +1,454 @@
+"""
+flow_tiles.py
+
+Provides a precomputed pyramid of origin-destination (OD) flow matrices by hour.
+
+Each zoom level splits the world into a 2^zoom x 2^zoom grid of cells. Trips are
+binned into (origin cell, destination cell, hour) with a vectorized histogram and
+the non-empty bins are stored on disk as sparse arrays, one file per zoom level.
+The levels are updated incrementally with the trips added by each ingestion and
+are kept in memory to serve flow tiles in milliseconds.
+
+Every update writes a new version of all the levels and then commits it by
+replacing a small manifest file, so readers never see a partially applied update.
+Before trips are stored, the manifest is marked pending; if the matching update
+never completes, the next update rebuilds the levels from the database.
+
+Modules:
+- os: Used for the tile storage paths.
+- json: Used for the manifest recording the current version of the levels.
+- math: Used to validate the parsed coordinates.
+- time: Used to number the versions of the levels.
+- numpy: Provides the vectorized histogramming and sparse array storage.
+- app.database.models: Contains ORM models for the database.
+- sqlalchemy: ORM for database interactions.
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import os
+import json
+import math
+import time
+import numpy as np
+from app.database.models import Trip
+from sqlalchemy.orm import Session
+
+# -------------------------
+# Constants
+# -------------------------
+
+# Directory where the flow tiles are stored.
+FLOW_TILES_DIR = os.getenv("FLOW_TILES_DIR", "data/flow_tiles")
+
+# Zoom levels of the pyramid. Bin keys are packed into int64, which caps the zoom at 14.
+ZOOM_LEVELS = (8, 10, 12, 14)
+
+# Largest number of grid cells a tile bounding box may cover.
+MAX_TILE_CELLS = 64 * 64
+
+# Largest number of flows returned for a tile.
+MAX_TILE_FLOWS = 1000
+
+HOURS_PER_DAY = 24
+
+# In-memory copy of the stored levels: zoom -> (version, decoded arrays)
+_levels_cache = {}
+
+# -------------------------
+# Helper Functions
+# -------------------------
+def _manifest_path():
+    """Returns the path of the manifest recording the current version of the levels."""
+    return os.path.join(FLOW_TILES_DIR, "manifest.json")
+
+def _level_path(zoom: int, version: int):
+    """Returns the path of the file storing a version of the given zoom level."""
+    return os.path.join(FLOW_TILES_DIR, f"od_z{zoom}.v{version}.npz")
+
+def _read_manifest():
+    """
+    Read the manifest of the levels.
+
+    Returns:
+        dict: The committed version and the pending update token, or None if the
+              tiles have not been built, were built for other zoom levels or are stale.
+    """
+    try:
+        with open(_manifest_path(), "r", encoding="utf-8") as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        return None
+
+    if manifest.get("zoom_levels") != list(ZOOM_LEVELS):
+        return None
+    return manifest
+
+def _write_manifest(version: int, pending=None):
+    """Replace the manifest atomically, committing the given version of the levels."""
+    temporary_path = _manifest_path() + ".tmp"
+    with open(temporary_path, "w", encoding="utf-8") as file:
+        json.dump({"version": version, "zoom_levels": list(ZOOM_LEVELS), "pending": pending}, file)
+    os.replace(temporary_path, _manifest_path())
+
+def _current_version():
+    """
+    Read the committed version of the levels from the manifest.
+
+    Returns:
+        int: The current version, or None if the tiles have not been built or are stale.
+    """
+    manifest = _read_manifest()
+    return manifest["version"] if manifest else None
+
+def _parse_point(coord):
+    """
+    Parse a "POINT (x y)" string.
+
+    Args:
+        coord (str): The coordinate string.
+
+    Returns:
+        tuple: The x and y of the point, or None if the string is not a valid point.
+    """
+    if not isinstance(coord, str):
+        return None
+
+    coord = coord.strip()
+    if not (coord.upper().startswith("POINT") and coord.endswith(")") and "(" in coord):
+        return None
+
+    values = coord[coord.index("(") + 1:-1].split()
+    if len(values) != 2:
+        return None
+
+    try:
+        x, y = float(values[0]), float(values[1])
+    except ValueError:
+        return None
+
+    if not (math.isfinite(x) and math.isfinite(y)):
+        return None
+    return x, y
+
+def _cell_indices(points, zoom: int):
+    """Returns the grid column and row of each point at the given zoom level."""
+    size = 2 ** zoom
+    x = np.clip(((points[:, 0] + 180.0) / 360.0 * size).astype(np.int64), 0, size - 1)
+    y = np.clip(((points[:, 1] + 90.0) / 180.0 * size).astype(np.int64), 0, size - 1)
+    return x, y
+
+def _cell_centers(x, y, zoom: int):
+    """Returns the x and y coordinates of the centers of the given grid cells."""
+    size = 2 ** zoom
+    return (x + 0.5) * 360.0 / size - 180.0, (y + 0.5) * 180.0 / size - 90.0
+
+def _trip_arrays(flows):
+    """
+    Convert trips into coordinate and hour arrays, skipping invalid trips.
+
+    Args:
+        flows (list): A list of (origin_coord, destination_coord, datetime) tuples.
+
+    Returns:
+        tuple: The origin points, destination points and hours of the valid trips,
+               and the number of trips skipped because of a missing or malformed value.
+    """
+    origins, destinations, hours = [], [], []
+    for origin_coord, destination_coord, date_time in flows:
+        origin = _parse_point(origin_coord)
+        destination = _parse_point(destination_coord)
+        if origin is None or destination is None or date_time is None:
+            continue
+
+        origins.append(origin)
+        destinations.append(destination)
+        hours.append(date_time.hour)
+
+    return (
+        np.array(origins, dtype=np.float64).reshape(-1, 2),
+        np.array(destinations, dtype=np.float64).reshape(-1, 2),
+        np.array(hours, dtype=np.int64),
+        len(flows) - len(hours)
+    )
+
+def _histogram(origins, destinations, hours, zoom: int):
+    """
+    Count the trips per (origin cell, destination cell, hour) bin.
+
+    Returns:
+        tuple: The sorted keys of the non-empty bins and the trip count of each bin.
+    """
+    cells = 4 ** zoom
+    size = 2 ** zoom
+    origin_x, origin_y = _cell_indices(origins, zoom)
+    destination_x, destination_y = _cell_indices(destinations, zoom)
+
+    origin_cells = origin_x * size + origin_y
+    destination_cells = destination_x * size + destination_y
+    keys = (origin_cells * cells + destination_cells) * HOURS_PER_DAY + hours
+    keys, counts = np.unique(keys, return_counts=True)
+    return keys, counts.astype(np.int64)
+
+def _merge(keys_a, counts_a, keys_b, counts_b):
+    """Sum two sparse histograms into one with sorted, unique keys."""
+    keys, inverse = np.unique(np.concatenate([keys_a, keys_b]), return_inverse=True)
+    counts = np.bincount(inverse, weights=np.concatenate([counts_a, counts_b]))
+    return keys, counts.astype(np.int64)
+
+def _load_level(zoom: int, version: int):
+    """
+    Read the sparse histogram of a version of a zoom level from disk.
+
+    Returns:
+        tuple: The bin keys and counts, empty if there is no committed version.
+    """
+    if version is None:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    with np.load(_level_path(zoom, version)) as data:
+        return data["keys"], data["counts"]
+
+def _save_levels(levels):
+    """
+    Write every zoom level as a new version and commit it in the manifest.
+
+    The new files are written next to the current ones and only become visible
+    when the manifest is replaced, after which the older versions are removed.
+    Versions are timestamps, so a rebuild never reuses the number of a cached version.
+
+    Args:
+        levels (dict): The bin keys and counts of each zoom level.
+    """
+    os.makedirs(FLOW_TILES_DIR, exist_ok=True)
+    new_version = time.time_ns()
+
+    for zoom, (keys, counts) in levels.items():
+        with open(_level_path(zoom, new_version), "wb") as file:
+            np.savez_compressed(file, keys=keys, counts=counts)
+
+    _write_manifest(new_version)
+
+    current_files = {os.path.basename(_level_path(zoom, new_version)) for zoom in levels}
+    for name in os.listdir(FLOW_TILES_DIR):
+        if name.startswith("od_z") and name.endswith(".npz") and name not in current_files:
+            os.remove(os.path.join(FLOW_TILES_DIR, name))
+
+def _cached_level(zoom: int):
+    """
+    Get the decoded bins of a zoom level, reloading them when a new version is committed.
+
+    Returns:
+        dict: The origin/destination cell columns and rows, hours and counts of the bins,
+              sorted by origin column, or None if the tiles have not been built or are stale.
+    """
+    version = _current_version()
+    if version is None:
+        return None
+
+    cached = _levels_cache.get(zoom)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    try:
+        keys, counts = _load_level(zoom, version)
+    except FileNotFoundError:
+        # A newer version was committed and this one removed while reading
+        version = _current_version()
+        if version is None:
+            return None
+        keys, counts = _load_level(zoom, version)
+    cells = 4 ** zoom
+    size = 2 ** zoom
+    pairs, hours = np.divmod(keys, HOURS_PER_DAY)
+    origin_cells, destination_cells = np.divmod(pairs, cells)
+    origin_x, origin_y = np.divmod(origin_cells, size)
+    destination_x, destination_y = np.divmod(destination_cells, size)
+
+    level = {
+        "origin_x": origin_x, "origin_y": origin_y,
+        "destination_x": destination_x, "destination_y": destination_y,
+        "pairs": pairs, "hours": hours, "counts": counts
+    }
+    _levels_cache[zoom] = (version, level)
+    return level
+
+# -------------------------
+# Tile Building
+# -------------------------
+def build_flow_tiles(session: Session):
+    """
+    Build every zoom level of the pyramid from all the trips in the database.
+
+    Args:
+        session (Session): The SQLAlchemy session.
+
+    Returns:
+        None
+    """
+    flows = session.query(Trip.origin_coord, Trip.destination_coord, Trip.datetime).all()
+    origins, destinations, hours, skipped = _trip_arrays(flows)
+    if skipped:
+        print(f"Skipped {skipped} trips with missing or malformed values in the flow tiles.")
+
+    levels = {zoom: _histogram(origins, destinations, hours, zoom) for zoom in ZOOM_LEVELS}
+    _save_levels(levels)
+
+def begin_flow_tiles_update():
+    """
+    Mark the flow tiles as pending an update, before the new trips are stored.
+
+    Until update_flow_tiles is called with the returned token, any other update
+    rebuilds the levels from the database, so trips stored by an ingestion that
+    died before updating the tiles are not missed.
+
+    Returns:
+        int: The token to pass to update_flow_tiles.
+    """
+    token = time.time_ns()
+    manifest = _read_manifest()
+
+    # Keep the marker of an earlier update that never completed, so it forces a rebuild
+    if manifest and manifest.get("pending") is None:
+        _write_manifest(manifest["version"], pending=token)
+    return token
+
+def update_flow_tiles(session: Session, flows, token=None):
+    """
+    Add newly ingested trips to every zoom level of the pyramid.
+
+    If the tiles have not been built yet, were marked stale, or are pending another
+    update, the whole pyramid is built from the database, which is expected to
+    already contain the new trips.
+
+    Args:
+        session (Session): The SQLAlchemy session.
+        flows (list): A list of (origin_coord, destination_coord, datetime) tuples
+                      for the trips added since the last update.
+        token (int): The token returned by begin_flow_tiles_update for these trips.
+
+    Returns:
+        None
+    """
+    manifest = _read_manifest()
+    if manifest is None or manifest.get("pending") not in (None, token):
+        build_flow_tiles(session)
+        return
+
+    version = manifest["version"]
+    if not flows:
+        _write_manifest(version)
+        return
+
+    origins, destinations, hours, skipped = _trip_arrays(flows)
+    if skipped:
+        print(f"Skipped {skipped} trips with missing or malformed values in the flow tiles.")
+
+    levels = {}
+    for zoom in ZOOM_LEVELS:
+        new_keys, new_counts = _histogram(origins, destinations, hours, zoom)
+        levels[zoom] = _merge(*_load_level(zoom, version), new_keys, new_counts)
+    _save_levels(levels)
+
+def invalidate_flow_tiles():
+    """
+    Mark the flow tiles as stale, so the next update rebuilds them from the database.
+
+    Returns:
+        None
+    """
+    try:
+        os.remove(_manifest_path())
+    except FileNotFoundError:
+        pass
+
+# -------------------------
+# Tile Queries
+# -------------------------
+def flow_tile(zoom: int, x1, y1, x2, y2, start_hour: int = 0, end_hour: int = 23, limit: int = MAX_TILE_FLOWS):
+    """
+    Get the largest origin-destination flows between the cells of a bounding box.
+
+    Args:
+        zoom (int): The zoom level, one of ZOOM_LEVELS.
+        x1 (float): The x-coordinate of a corner of the bounding box.
+        y1 (float): The y-coordinate of a corner of the bounding box.
+        x2 (float): The x-coordinate of the opposite corner of the bounding box.
+        y2 (float): The y-coordinate of the opposite corner of the bounding box.
+        start_hour (int): The first hour of the day to include.
+        end_hour (int): The last hour of the day to include. When smaller than
+                        start_hour, the range wraps around midnight.
+        limit (int): The largest number of flows to return, at most MAX_TILE_FLOWS.
+
+    Returns:
+        dict: The flows where both cells lie in the bounding box, largest first, with the
+              origin and destination cell centers and the trip count of each flow, and the
+              total number of matching flows.
+              Example: {"flows": [{"origin": [14.43, 50.05], "destination": [14.48, 50.09], "count": 3}, ...],
+                        "total_flows": 42}
+              None if the tiles have not been built or are stale.
+
+    Raises:
+        ValueError: If the zoom, hours or limit are invalid, or the bounding box
+                    covers more than MAX_TILE_CELLS cells.
+    """
+    if zoom not in ZOOM_LEVELS:
+        raise ValueError(f"Zoom must be one of {list(ZOOM_LEVELS)}.")
+    if not (0 <= start_hour < HOURS_PER_DAY and 0 <= end_hour < HOURS_PER_DAY):
+        raise ValueError("Hours must be between 0 and 23.")
+    if not 1 <= limit <= MAX_TILE_FLOWS:
+        raise ValueError(f"Limit must be between 1 and {MAX_TILE_FLOWS}.")
+
+    corners = np.array([[min(x1, x2), min(y1, y2)], [max(x1, x2), max(y1, y2)]], dtype=np.float64)
+    (min_x, max_x), (min_y, max_y) = _cell_indices(corners, zoom)
+    if (max_x - min_x + 1) * (max_y - min_y + 1) > MAX_TILE_CELLS:
+        raise ValueError(f"The bounding box covers more than {MAX_TILE_CELLS} cells at zoom {zoom}.")
+
+    # Bins are sorted by origin column, so the columns of the box are a contiguous slice
+    level = _cached_level(zoom)
+    if level is None:
+        return None
+
+    start = np.searchsorted(level["origin_x"], min_x, side="left")
+    stop = np.searchsorted(level["origin_x"], max_x, side="right")
+    origin_y = level["origin_y"][start:stop]
+    destination_x = level["destination_x"][start:stop]
+    destination_y = level["destination_y"][start:stop]
+    hours = level["hours"][start:stop]
+
+    mask = (
+        (origin_y >= min_y) & (origin_y <= max_y)
+        & (destination_x >= min_x) & (destination_x <= max_x)
+        & (destination_y >= min_y) & (destination_y <= max_y)
+    )
+    if start_hour <= end_hour:
+        mask &= (hours >= start_hour) & (hours <= end_hour)
+    else:
+        mask &= (hours >= start_hour) | (hours <= end_hour)
+
+    # Sum the selected hours of each origin-destination pair, which are adjacent
+    selected = start + np.flatnonzero(mask)
+    if not len(selected):
+        return {"flows": [], "total_flows": 0}
+
+    pairs = level["pairs"][selected]
+    first = np.flatnonzero(np.concatenate([[True], pairs[1:] != pairs[:-1]]))
+    counts = np.add.reduceat(level["counts"][selected], first)
+    selected = selected[first]
+
+    # Keep the largest flows, ordered by count and then by cell
+    top = np.lexsort((np.arange(len(counts)), -counts))[:limit]
+
+    origin_lon, origin_lat = _cell_centers(level["origin_x"][selected[top]], level["origin_y"][selected[top]], zoom)
+    destination_lon, destination_lat = _cell_centers(level["destination_x"][selected[top]], level["destination_y"][selected[top]], zoom)
+
+    flows = [
+        {
+            "origin": [float(origin_lon[i]), float(origin_lat[i])],
+            "destination": [float(destination_lon[i]), float(destination_lat[i])],
+            "count": int(counts[top[i]])
+        }
+        for i in range(len(top))
+    ]
+    return {"flows": flows, "total_flows": len(counts)}
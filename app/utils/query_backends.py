@@ -0,0 +1,273 @@
+"""
+query_backends.py
+
+Provides interchangeable backends for running the trip analytics queries.
+
+The PostgreSQL backend delegates to the ORM helpers in query_helpers, while the
+DuckDB backend runs the same analytics on an embedded columnar engine, either
+directly against the PostgreSQL trips table or against raw CSV/Parquet files.
+
+Modules:
+- os: Used to read the backend selection from environment variables.
+- abc: Defines the abstract backend interface.
+- atexit, threading: Manage the DuckDB connection shared between requests.
+- duckdb: Embedded analytical (columnar) database engine.
+- app.database.session: Provides database session functionalities.
+- app.utils.query_helpers: Houses helper functions for querying the database.
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import os
+import atexit
+import threading
+from abc import ABC, abstractmethod
+import duckdb
+from app.database.session import DATABASE_URL, SessionLocal as Session
+from app.utils.query_helpers import (
+    weekly_average_for_bounding_box,
+    weekly_average_by_region,
+    regions_for_datasource,
+    most_recent_datasource_for_top_regions,
+    total_records_in_database
+)
+
+# -------------------------
+# Constants
+# -------------------------
+
+# The backend used by the API resources: "postgres" or "duckdb".
+ANALYTICS_BACKEND = os.getenv("ANALYTICS_BACKEND", "postgres")
+
+# The data read by the DuckDB backend: a PostgreSQL URL, or a CSV (optionally gzipped)/Parquet file or glob.
+ANALYTICS_SOURCE = os.getenv("ANALYTICS_SOURCE", DATABASE_URL)
+
+# -------------------------
+# Backend Definitions
+# -------------------------
+class QueryBackend(ABC):
+    """
+    Base class for the analytics query backends.
+
+    Backends are used as context managers and return results in the same
+    format as the helpers in query_helpers. Leaving the context releases the
+    resources the backend acquired for the request.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @abstractmethod
+    def close(self):
+        """Releases the resources held by the backend."""
+
+    @abstractmethod
+    def weekly_average_for_bounding_box(self, x1, y1, x2, y2):
+        """Weekly trip counts within a bounding box, see query_helpers."""
+
+    @abstractmethod
+    def weekly_average_by_region(self, region: str):
+        """Weekly trip counts within a region, see query_helpers."""
+
+    @abstractmethod
+    def regions_for_datasource(self, datasource: str):
+        """Regions in which a datasource appears, see query_helpers."""
+
+    @abstractmethod
+    def most_recent_datasource_for_top_regions(self):
+        """Most recent datasource of the two busiest regions, see query_helpers."""
+
+    @abstractmethod
+    def total_records_in_database(self):
+        """Total number of trips, see query_helpers."""
+
+
+class PostgresBackend(QueryBackend):
+    """
+    Backend running the analytics through the SQLAlchemy ORM on PostgreSQL.
+    """
+    def __init__(self, session=None):
+        self.session = session or Session()
+
+    def close(self):
+        self.session.close()
+
+    def weekly_average_for_bounding_box(self, x1, y1, x2, y2):
+        return weekly_average_for_bounding_box(self.session, x1, y1, x2, y2)
+
+    def weekly_average_by_region(self, region: str):
+        return weekly_average_by_region(self.session, region)
+
+    def regions_for_datasource(self, datasource: str):
+        return regions_for_datasource(self.session, datasource)
+
+    def most_recent_datasource_for_top_regions(self):
+        return most_recent_datasource_for_top_regions(self.session)
+
+    def total_records_in_database(self):
+        return total_records_in_database(self.session)
+
+
+def create_duckdb_connection(source: str = ANALYTICS_SOURCE):
+    """
+    Create an in-memory DuckDB database exposing the trips as a `trips` view.
+
+    The view reads the source on every query, so it always returns the current data.
+
+    Args:
+        source (str): A postgres:// or postgresql:// URL, or the path (or glob) of
+                      .csv, .csv.gz or .parquet files.
+
+    Returns:
+        duckdb.DuckDBPyConnection: The connection to the DuckDB database.
+
+    Raises:
+        ValueError: If the source is not a PostgreSQL URL or a supported file type.
+    """
+    columns = "region, origin_coord, destination_coord, CAST(datetime AS TIMESTAMP) AS datetime, datasource"
+    quoted_source = "'" + source.replace("'", "''") + "'"
+    lowered = source.lower()
+    is_postgres = lowered.startswith(("postgres://", "postgresql://"))
+
+    if is_postgres:
+        trips_select = f"SELECT {columns} FROM pg.public.trips"
+    elif lowered.endswith((".csv", ".csv.gz")):
+        trips_select = f"SELECT {columns} FROM read_csv_auto({quoted_source}, header=true)"
+    elif lowered.endswith(".parquet"):
+        trips_select = f"SELECT {columns} FROM read_parquet({quoted_source})"
+    else:
+        raise ValueError(f"Unsupported analytics source: {source}")
+
+    connection = duckdb.connect()
+    try:
+        if is_postgres:
+            connection.execute("INSTALL postgres")
+            connection.execute("LOAD postgres")
+            connection.execute(f"ATTACH {quoted_source} AS pg (TYPE POSTGRES, READ_ONLY)")
+        connection.execute(f"CREATE VIEW trips AS {trips_select}")
+    except Exception:
+        connection.close()
+        raise
+    return connection
+
+
+class DuckDBBackend(QueryBackend):
+    """
+    Backend running the analytics vectorized on an embedded DuckDB database.
+
+    Each backend queries through its own cursor, so backends sharing a connection
+    can be used from several threads. The connection is only closed with the
+    backend when the backend created it.
+
+    The week buckets match the PostgreSQL path (weeks start on Monday) and are
+    returned in the same order. The bounding box filter compares the coordinate
+    strings like the ORM helper does, but DuckDB compares bytes while PostgreSQL
+    uses the database collation, so the rows only match under the C collation.
+    """
+    def __init__(self, source: str = ANALYTICS_SOURCE, connection=None):
+        self.owns_connection = connection is None
+        self.connection = connection or create_duckdb_connection(source)
+        self.cursor = self.connection.cursor()
+
+    def _fetch(self, query: str, parameters=None):
+        """Run a query on the backend cursor and return all the rows."""
+        return self.cursor.execute(query, parameters or []).fetchall()
+
+    def close(self):
+        self.cursor.close()
+        if self.owns_connection:
+            self.connection.close()
+
+    def weekly_average_for_bounding_box(self, x1, y1, x2, y2):
+        lower, upper = f"POINT ({x1} {y1})", f"POINT ({x2} {y2})"
+        results = self._fetch(
+            """
+            SELECT date_trunc('week', datetime) AS week_start, COUNT(*)
+            FROM trips
+            WHERE origin_coord BETWEEN ? AND ?
+              AND destination_coord BETWEEN ? AND ?
+            GROUP BY week_start
+            ORDER BY week_start
+            """,
+            [lower, upper, lower, upper]
+        )
+        return [{"week": r[0].strftime('%Y-%m-%d'), "count": r[1]} for r in results]
+
+    def weekly_average_by_region(self, region: str):
+        results = self._fetch(
+            """
+            SELECT date_trunc('week', datetime) AS week_start, COUNT(*)
+            FROM trips
+            WHERE region = ?
+            GROUP BY week_start
+            ORDER BY week_start
+            """,
+            [region]
+        )
+        return [{"week": r[0].strftime('%Y-%m-%d'), "count": r[1]} for r in results]
+
+    def regions_for_datasource(self, datasource: str):
+        results = self._fetch("SELECT DISTINCT region FROM trips WHERE datasource = ?", [datasource])
+        return [r[0] for r in results]
+
+    def most_recent_datasource_for_top_regions(self):
+        # The latest datasource per region is picked in a single pass with arg_max
+        results = self._fetch(
+            """
+            WITH top_regions AS (
+                SELECT region
+                FROM trips
+                GROUP BY region
+                ORDER BY COUNT(*) DESC
+                LIMIT 2
+            )
+            SELECT region, arg_max(datasource, datetime), MAX(datetime)
+            FROM trips
+            WHERE region IN (SELECT region FROM top_regions)
+            GROUP BY region
+            """
+        )
+        return {region: {'datasource': datasource, 'datetime': max_datetime} for region, datasource, max_datetime in results}
+
+    def total_records_in_database(self):
+        return self._fetch("SELECT COUNT(*) FROM trips")[0][0]
+
+# -------------------------
+# Backend Selection
+# -------------------------
+_duckdb_connection = None
+_duckdb_connection_lock = threading.Lock()
+
+def _shared_duckdb_connection():
+    """
+    Get the DuckDB connection shared between requests, creating it on first use.
+
+    The connection is closed when the interpreter exits.
+    """
+    global _duckdb_connection
+
+    with _duckdb_connection_lock:
+        if _duckdb_connection is None:
+            _duckdb_connection = create_duckdb_connection()
+            atexit.register(_duckdb_connection.close)
+        return _duckdb_connection
+
+def get_query_backend(name: str = ANALYTICS_BACKEND):
+    """
+    Get the analytics backend to use for a request.
+
+    Args:
+        name (str): The backend name, "postgres" or "duckdb".
+
+    Returns:
+        QueryBackend: A new backend, to be closed at the end of the request.
+    """
+    if name == "postgres":
+        return PostgresBackend()
+    if name == "duckdb":
+        return DuckDBBackend(connection=_shared_duckdb_connection())
+
+    raise ValueError(f"Unknown analytics backend: {name}")
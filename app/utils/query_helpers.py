@@ -58,6 +58,9 @@ def weekly_average_for_bounding_box(session: Session, x1, y1, x2, y2):
     Returns:
         list: A list of dictionaries containing the week start date and the count of trips for each week.
               Example: [{"week": "2023-09-05", "count": 42}, {"week": "2023-09-12", "count": 56}, ...]
+
+    Note:
+        The coordinates are compared as strings using the database collation.
     """
     results = session.query(
         func.date_trunc('week', Trip.datetime).label('week_start'),
@@ -67,7 +70,7 @@ def weekly_average_for_bounding_box(session: Session, x1, y1, x2, y2):
             Trip.origin_coord.between(f"POINT ({x1} {y1})", f"POINT ({x2} {y2})"),
             Trip.destination_coord.between(f"POINT ({x1} {y1})", f"POINT ({x2} {y2})")
         )
-    ).group_by(func.date_trunc('week', Trip.datetime)).all()
+    ).group_by(func.date_trunc('week', Trip.datetime)).order_by(func.date_trunc('week', Trip.datetime)).all()
     
     return [{"week": r[0].strftime('%Y-%m-%d'), "count": r[1]} for r in results]
 
@@ -86,7 +89,7 @@ def weekly_average_by_region(session: Session, region: str):
     results = session.query(
         func.date_trunc('week', Trip.datetime).label('week_start'),
         func.count(Trip.id)
-    ).filter(Trip.region == region).group_by(func.date_trunc('week', Trip.datetime)).all()
+    ).filter(Trip.region == region).group_by(func.date_trunc('week', Trip.datetime)).order_by(func.date_trunc('week', Trip.datetime)).all()
     
     return [{"week": r[0].strftime('%Y-%m-%d'), "count": r[1]} for r in results]
 
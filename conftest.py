@@ -0,0 +1,10 @@
+"""
+conftest.py
+
+Makes the application packages importable when the tests are run from any directory.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -1,6 +1,7 @@
 # Standard library imports
 from flask import Flask
 from flask_restful import Api
+from werkzeug.routing import FloatConverter
 
 # Local application imports
 from app.database.session import engine
@@ -13,14 +14,23 @@ from app.resources.analytics import (
     DataSourceRegions,
     MostRecentDataSourceForTopRegions,
     TotalRecords,
-    SelectAllRecords
+    SelectAllRecords,
+    FlowTile
 )
 
 
 # ===============================
 # App and API Initialization
 # ===============================
+class CoordinateConverter(FloatConverter):
+    """
+    URL converter for coordinates, accepting negative and integer values.
+    """
+    regex = r"-?\d+(?:\.\d+)?"
+
+
 app = Flask(__name__)
+app.url_map.converters["coordinate"] = CoordinateConverter
 api = Api(app)
 
 
@@ -35,6 +45,7 @@ def setup_resources():
     api.add_resource(MostRecentDataSourceForTopRegions, "/most_recent_datasource_for_top_regions")
     api.add_resource(TotalRecords, "/total_records")
     api.add_resource(SelectAllRecords, "/select_all_records")
+    api.add_resource(FlowTile, "/flow_tile/<int:zoom>/<coordinate:x1>/<coordinate:y1>/<coordinate:x2>/<coordinate:y2>")
 
 
 def setup_database():
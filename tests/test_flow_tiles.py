@@ -0,0 +1,205 @@
+"""
+test_flow_tiles.py
+
+Tests the origin-destination flow tiles without a database, storing the tiles
+in a temporary directory.
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import csv
+import os
+from datetime import datetime
+import numpy as np
+import pytest
+import main
+from app.utils import flow_tiles
+
+TRIPS_CSV = os.path.join(os.path.dirname(__file__), "..", "data", "trips.csv")
+
+# -------------------------
+# Fixtures
+# -------------------------
+class FakeSession:
+    """Stands in for a SQLAlchemy session returning the given trips."""
+    def __init__(self, flows):
+        self.flows = flows
+
+    def query(self, *columns):
+        return self
+
+    def all(self):
+        return self.flows
+
+
+@pytest.fixture
+def flows():
+    with open(TRIPS_CSV, "r", encoding="utf-8") as file:
+        return [
+            (row["origin_coord"], row["destination_coord"], datetime.strptime(row["datetime"], "%Y-%m-%d %H:%M:%S"))
+            for row in csv.DictReader(file)
+        ]
+
+
+@pytest.fixture(autouse=True)
+def tiles_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(flow_tiles, "FLOW_TILES_DIR", str(tmp_path))
+    monkeypatch.setattr(flow_tiles, "_levels_cache", {})
+    return tmp_path
+
+
+@pytest.fixture(scope="module")
+def client():
+    # Resources can only be registered once on the module-level API
+    main.setup_resources()
+    return main.app.test_client()
+
+def total_count(tile):
+    return sum(flow["count"] for flow in tile["flows"])
+
+# -------------------------
+# Tests
+# -------------------------
+def test_histogram_merge_round_trip(flows):
+    origins, destinations, hours, skipped = flow_tiles._trip_arrays(flows)
+    assert skipped == 0
+
+    full_keys, full_counts = flow_tiles._histogram(origins, destinations, hours, 12)
+    first = flow_tiles._histogram(origins[:60], destinations[:60], hours[:60], 12)
+    second = flow_tiles._histogram(origins[60:], destinations[60:], hours[60:], 12)
+    keys, counts = flow_tiles._merge(*first, *second)
+
+    assert np.array_equal(keys, full_keys)
+    assert np.array_equal(counts, full_counts)
+    assert counts.sum() == len(flows)
+
+def test_incremental_update_equals_full_build(flows, tiles_dir):
+    flow_tiles.update_flow_tiles(FakeSession(flows[:60]), flows[:60])
+    flow_tiles.update_flow_tiles(FakeSession([]), flows[60:])
+    incremental = {zoom: flow_tiles._load_level(zoom, flow_tiles._current_version()) for zoom in flow_tiles.ZOOM_LEVELS}
+
+    flow_tiles.build_flow_tiles(FakeSession(flows))
+    for zoom in flow_tiles.ZOOM_LEVELS:
+        keys, counts = flow_tiles._load_level(zoom, flow_tiles._current_version())
+        assert np.array_equal(incremental[zoom][0], keys)
+        assert np.array_equal(incremental[zoom][1], counts)
+
+    # Only the committed version of each level is kept
+    assert len([name for name in os.listdir(tiles_dir) if name.endswith(".npz")]) == len(flow_tiles.ZOOM_LEVELS)
+
+def test_invalidated_tiles_are_rebuilt(flows):
+    flow_tiles.update_flow_tiles(FakeSession(flows[:60]), flows[:60])
+    assert flow_tiles.flow_tile(8, 14.0, 49.5, 15.0, 50.5)["flows"]
+
+    flow_tiles.invalidate_flow_tiles()
+    assert flow_tiles._current_version() is None
+    assert flow_tiles.flow_tile(8, 14.0, 49.5, 15.0, 50.5) is None
+
+    # The new trips are ignored, the database already contains them
+    flow_tiles.update_flow_tiles(FakeSession(flows), flows[60:])
+    assert total_count(flow_tiles.flow_tile(8, 0.0, 0.0, 20.0, 60.0)) == len(flows)
+
+def test_update_after_interrupted_ingestion_rebuilds(flows):
+    flow_tiles.build_flow_tiles(FakeSession(flows[:40]))
+
+    # An ingestion stores trips 40 to 60, then dies before updating the tiles
+    flow_tiles.begin_flow_tiles_update()
+
+    token = flow_tiles.begin_flow_tiles_update()
+    flow_tiles.update_flow_tiles(FakeSession(flows), flows[60:], token)
+    assert total_count(flow_tiles.flow_tile(8, 0.0, 0.0, 20.0, 60.0)) == len(flows)
+
+def test_update_with_matching_token_is_incremental(flows):
+    flow_tiles.build_flow_tiles(FakeSession(flows[:60]))
+
+    token = flow_tiles.begin_flow_tiles_update()
+    flow_tiles.update_flow_tiles(FakeSession([]), flows[60:], token)
+    assert total_count(flow_tiles.flow_tile(8, 0.0, 0.0, 20.0, 60.0)) == len(flows)
+
+    # The update committed, so the tiles are no longer pending
+    flow_tiles.update_flow_tiles(FakeSession([]), [])
+    assert total_count(flow_tiles.flow_tile(8, 0.0, 0.0, 20.0, 60.0)) == len(flows)
+
+def test_invalid_trips_are_skipped():
+    flows = [
+        ("POINT (14.4 50.0)", "POINT (14.5 50.1)", datetime(2018, 5, 1, 8)),
+        (None, "POINT (14.5 50.1)", datetime(2018, 5, 1, 8)),
+        ("14.4 50.0", "POINT (14.5 50.1)", datetime(2018, 5, 1, 8)),
+        ("POINT (14.4)", "POINT (14.5 50.1)", datetime(2018, 5, 1, 8)),
+        ("POINT (14.4 abc)", "POINT (14.5 50.1)", datetime(2018, 5, 1, 8)),
+        ("POINT (14.4 50.0)", "POINT (14.5 50.1)", None)
+    ]
+    origins, destinations, hours, skipped = flow_tiles._trip_arrays(flows)
+
+    assert skipped == 5
+    assert origins.tolist() == [[14.4, 50.0]]
+    assert destinations.tolist() == [[14.5, 50.1]]
+    assert hours.tolist() == [8]
+
+def test_hour_range_wraps_around_midnight(flows):
+    flow_tiles.build_flow_tiles(FakeSession(flows))
+
+    night = flow_tiles.flow_tile(8, 14.0, 49.5, 15.0, 50.5, start_hour=22, end_hour=3)
+    day = flow_tiles.flow_tile(8, 14.0, 49.5, 15.0, 50.5, start_hour=4, end_hour=21)
+    prague = [flow for flow in flows if flow[0].startswith("POINT (14.")]
+
+    assert sum(flow["count"] for flow in night["flows"]) == sum(1 for flow in prague if flow[2].hour >= 22 or flow[2].hour <= 3)
+    assert sum(flow["count"] for flow in night["flows"] + day["flows"]) == len(prague)
+
+def test_bounding_box_is_normalised(flows):
+    flow_tiles.build_flow_tiles(FakeSession(flows))
+
+    assert flow_tiles.flow_tile(8, 15.0, 50.5, 14.0, 49.5) == flow_tiles.flow_tile(8, 14.0, 49.5, 15.0, 50.5)
+
+def test_limit_keeps_largest_flows():
+    # Flows with distinct counts and ties around every cutoff, listed out of order
+    trips_per_origin = {9.5: 2, 1.5: 5, 7.5: 2, 3.5: 1, 5.5: 3, 11.5: 2, 13.5: 1, 15.5: 2}
+    flow_tiles.build_flow_tiles(FakeSession([
+        (f"POINT ({x} 1.5)", "POINT (0.5 0.5)", datetime(2018, 5, 1, 8))
+        for x, trips in trips_per_origin.items()
+        for _ in range(trips)
+    ]))
+
+    tile = flow_tiles.flow_tile(8, 0.0, 0.0, 20.0, 5.0)
+    assert [flow["count"] for flow in tile["flows"]] == [5, 3, 2, 2, 2, 2, 1, 1]
+    tied = [flow["origin"][0] for flow in tile["flows"] if flow["count"] == 2]
+    assert tied == sorted(tied)
+
+    for limit in range(1, len(trips_per_origin) + 1):
+        limited = flow_tiles.flow_tile(8, 0.0, 0.0, 20.0, 5.0, limit=limit)
+        assert limited["total_flows"] == len(trips_per_origin)
+        assert limited["flows"] == tile["flows"][:limit]
+
+@pytest.mark.parametrize("arguments", [
+    {"zoom": 9},
+    {"start_hour": 24},
+    {"end_hour": -1},
+    {"limit": 0},
+    {"x1": -180.0, "y1": -90.0, "x2": 180.0, "y2": 90.0}
+])
+def test_invalid_requests_are_rejected(arguments):
+    request = {"zoom": 8, "x1": 14.0, "y1": 49.5, "x2": 15.0, "y2": 50.5, **arguments}
+    with pytest.raises(ValueError):
+        flow_tiles.flow_tile(**request)
+
+def test_flow_tile_endpoint(flows, client):
+    flow_tiles.build_flow_tiles(FakeSession([
+        ("POINT (-74.0 40.7)", "POINT (-73.9 40.8)", datetime(2018, 5, 1, 8)),
+        *flows
+    ]))
+
+    response = client.get("/flow_tile/8/-74.1/40.5/-73.7/40.9")
+    assert response.status_code == 200
+    assert response.json["total_flows"] == 1
+
+    response = client.get("/flow_tile/8/14/49/15/51?start_hour=22&end_hour=3")
+    assert response.status_code == 200
+    assert response.json["flows"]
+
+    response = client.get("/flow_tile/9/14/49/15/51")
+    assert response.status_code == 400
+
+def test_flow_tile_endpoint_without_tiles(client):
+    response = client.get("/flow_tile/8/14/49/15/51")
+    assert response.status_code == 503
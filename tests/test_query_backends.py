@@ -0,0 +1,89 @@
+"""
+test_query_backends.py
+
+Tests the DuckDB analytics backend against the bundled trips CSV, without a
+PostgreSQL server. The expected values were computed independently from the CSV.
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import os
+from datetime import datetime
+import pytest
+from app.utils.query_backends import (
+    QueryBackend,
+    DuckDBBackend,
+    create_duckdb_connection,
+    get_query_backend
+)
+
+TRIPS_CSV = os.path.join(os.path.dirname(__file__), "..", "data", "trips.csv")
+
+# -------------------------
+# Fixtures
+# -------------------------
+@pytest.fixture
+def backend():
+    with DuckDBBackend(TRIPS_CSV) as duckdb_backend:
+        yield duckdb_backend
+
+# -------------------------
+# Tests
+# -------------------------
+def test_weekly_average_for_bounding_box(backend):
+    assert backend.weekly_average_for_bounding_box(14.4, 49.9, 14.6, 50.1) == [
+        {"week": "2018-04-30", "count": 4},
+        {"week": "2018-05-07", "count": 3},
+        {"week": "2018-05-14", "count": 1},
+        {"week": "2018-05-21", "count": 1},
+        {"week": "2018-05-28", "count": 1}
+    ]
+
+def test_weekly_average_by_region(backend):
+    assert backend.weekly_average_by_region("Turin") == [
+        {"week": "2018-04-30", "count": 8},
+        {"week": "2018-05-07", "count": 6},
+        {"week": "2018-05-14", "count": 6},
+        {"week": "2018-05-21", "count": 14},
+        {"week": "2018-05-28", "count": 4}
+    ]
+    assert backend.weekly_average_by_region("Atlantis") == []
+
+def test_regions_for_datasource(backend):
+    assert sorted(backend.regions_for_datasource("funny_car")) == ["Hamburg", "Prague", "Turin"]
+    assert backend.regions_for_datasource("unknown_source") == []
+
+def test_most_recent_datasource_for_top_regions(backend):
+    assert backend.most_recent_datasource_for_top_regions() == {
+        "Turin": {"datasource": "pt_search_app", "datetime": datetime(2018, 5, 31, 6, 20, 59)},
+        "Prague": {"datasource": "cheap_mobile", "datetime": datetime(2018, 5, 29, 12, 44, 2)}
+    }
+
+def test_total_records_in_database(backend):
+    assert backend.total_records_in_database() == 100
+
+def test_shared_connection_stays_open():
+    connection = create_duckdb_connection(TRIPS_CSV)
+    with DuckDBBackend(connection=connection) as first:
+        assert first.total_records_in_database() == 100
+    with DuckDBBackend(connection=connection) as second:
+        assert second.total_records_in_database() == 100
+    connection.close()
+
+@pytest.mark.parametrize("source", ["data/trips.csv.bz2", "data", "data/*", "mysql://localhost/trips"])
+def test_unsupported_source(source):
+    with pytest.raises(ValueError):
+        create_duckdb_connection(source)
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        get_query_backend("sqlite")
+
+def test_incomplete_backend_cannot_be_created():
+    class IncompleteBackend(QueryBackend):
+        def close(self):
+            pass
+
+    with pytest.raises(TypeError):
+        IncompleteBackend()